@@ -5,23 +5,35 @@
 # Copyright © 2022 R.F. Smith <rsmith@xs4all.nl>
 # SPDX-License-Identifier: MIT
 # Created: 2022-10-01T10:01:55+0200
-# Last modified: 2023-12-23T00:13:43+0100
+# Last modified: 2026-10-15T21:40:00+0200
 """
 Extract the node-related data from a CalculiX FRD file and save it in formats
 suitable for use with programming languages.
 
-Currently supports JSON, sqlite3 and pickle (for Python) output formats.
+Currently supports JSON, sqlite3, pickle (for Python) and Parquet output
+formats.
 """
 
 import argparse
+import functools
 import itertools as itt
 import logging
+import mmap
 import os
 import pickle
 import sys
 import sqlite3
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
-__version__ = "2023.12.23"
+try:
+    import pyarrow  # Optional; needed to write Parquet files.
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+__version__ = "2026.10.15"
 __license__ = f"""{os.path.basename(__file__)} {__version__}
 Copyright © 2022 R.F. Smith
 
@@ -46,60 +58,77 @@ SOFTWARE.
 """
 
 # These data are node-related.
-# The first item, NODES is special. It contains the original positions of the
-# nodes.
-NODE_RELATED = (
-    "NODES",
-    "CP3DF",
-    "CT3D-MIS",
-    "CURR",
-    "DEPTH",
-    "DISP",
-    "DTIMF",
-    "ELPOT",
-    "EMFB",
-    "EMFE",
-    "ENER",
-    "ERROR",
-    "FLUX",
-    "FORC",
-    "HCRIT",
-    "M3DF",
-    "MAFLOW",
-    "MDISP",
-    "MESTRAIN",
-    "MSTRAIN",
-    "MSTRESS",
-    "NDTEMP",
-    "PDISP",
-    "PE",
-    "PFORC",
-    "PNDTEMP",
-    "PS3DF",
-    "PSTRESS",
-    "PT3DF",
-    "RFL",
-    "SDV",
-    "SEN",
-    "STPRES",
-    "STRESS",
-    "STRMID",
-    "STRNEG",
-    "STRPOS",
-    "STTEMP",
-    "THSTRAIN",
-    "TOPRES",
-    "TOSTRAIN",
-    "TOTEMP",
-    "TS3DF",
-    "TT3DF",
-    "TURB3DF",
-    "V3DF",
-    "VELO",
-    "VSTRES",
-    "ZZSTR",
+# NODES is special. It contains the original positions of the nodes.
+NODE_RELATED = frozenset(
+    (
+        "NODES",
+        "CP3DF",
+        "CT3D-MIS",
+        "CURR",
+        "DEPTH",
+        "DISP",
+        "DTIMF",
+        "ELPOT",
+        "EMFB",
+        "EMFE",
+        "ENER",
+        "ERROR",
+        "FLUX",
+        "FORC",
+        "HCRIT",
+        "M3DF",
+        "MAFLOW",
+        "MDISP",
+        "MESTRAIN",
+        "MSTRAIN",
+        "MSTRESS",
+        "NDTEMP",
+        "PDISP",
+        "PE",
+        "PFORC",
+        "PNDTEMP",
+        "PS3DF",
+        "PSTRESS",
+        "PT3DF",
+        "RFL",
+        "SDV",
+        "SEN",
+        "STPRES",
+        "STRESS",
+        "STRMID",
+        "STRNEG",
+        "STRPOS",
+        "STTEMP",
+        "THSTRAIN",
+        "TOPRES",
+        "TOSTRAIN",
+        "TOTEMP",
+        "TS3DF",
+        "TT3DF",
+        "TURB3DF",
+        "V3DF",
+        "VELO",
+        "VSTRES",
+        "ZZSTR",
+    )
 )
 
+# Buffer size for writing files.
+BUFSIZE = 1 << 20
+
+# Settings for writing sqlite3 databases.
+SQLITE_PRAGMAS = (
+    "journal_mode=MEMORY",
+    "synchronous=OFF",
+    "locking_mode=EXCLUSIVE",
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+)
+# Number of rows per executemany call.
+SQLITE_BATCH = 10000
+# Maximum number of parameters in a statement for SQLite < 3.32.
+SQLITE_VARIABLES = 999
+
 
 class _LicenseAction(argparse.Action):
     """Action class to print the license."""
@@ -112,14 +141,34 @@ class _LicenseAction(argparse.Action):
 def _main():
     """Entry point when frdconvert.py is called as a program."""
     args = _setup()
-    for infn in args.files:
-        contents = read_frd(infn)
-        if args.json:
-            write_json(contents, infn[:-4] + ".json")
-        elif args.pickle:
-            write_pickle(contents, infn[:-4] + ".pickle")
-        elif args.sqlite:
-            write_sqlite(contents, infn[:-4] + ".db")
+    if args.json:
+        writer, ext = write_json, ".json"
+    elif args.pickle:
+        writer, ext = write_pickle, ".pickle"
+    elif args.sqlite:
+        writer, ext = write_sqlite, ".db"
+    elif args.parquet:
+        writer, ext = write_parquet, "_parquet"
+    tasks = [(infn, infn[:-4] + ext, writer, args.only) for infn in args.files]
+    if args.jobs == 1:
+        for task in tasks:
+            _convert(*task)
+        return
+    # Files are independent, so they can be converted in parallel.
+    # Worker processes that are spawned rather than forked need their own
+    # logging configuration.
+    pool = ProcessPoolExecutor(
+        args.jobs or None, initializer=_setup_logging, initargs=(args.log,)
+    )
+    with pool:
+        for future in [pool.submit(_convert, *task) for task in tasks]:
+            future.result()
+
+
+def _convert(infn, outfn, writer, only):
+    """Read the FRD file infn and write its contents to outfn with writer."""
+    contents = read_frd(infn, only=only)
+    writer(contents, outfn)
 
 
 def _setup():
@@ -143,6 +192,11 @@ def _setup():
         action="store_true",
         help="save FRD file contents in sqlite3 database format",
     )
+    group.add_argument(
+        "--parquet",
+        action="store_true",
+        help="save FRD file contents as a directory of Parquet files",
+    )
     parser.add_argument(
         "-l", "--license", action=_LicenseAction, nargs=0, help="print the license"
     )
@@ -153,100 +207,203 @@ def _setup():
         choices=["debug", "info", "warning", "error"],
         help="logging level (defaults to 'warning')",
     )
+    parser.add_argument(
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help="number of files to convert in parallel; 0 is one per CPU (defaults to 1)",
+    )
+    parser.add_argument(
+        "--only",
+        metavar="NAMES",
+        help="comma-separated list of data sets to extract (defaults to all)",
+    )
     parser.add_argument(
         "files", metavar="file", nargs="*", help="one or more files to process"
     )
     args = parser.parse_args(sys.argv[1:])
+    if args.parquet and pyarrow is None:
+        parser.error("saving in Parquet format requires the pyarrow module")
+    if args.jobs < 0:
+        parser.error("the number of jobs cannot be negative")
+    _setup_logging(args.log)
+    if args.only is not None:
+        args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+        if not args.only:
+            parser.error("--only needs at least one data set name")
+        for name in sorted(set(args.only) - NODE_RELATED):
+            logging.warning(f"“{name}” is not a node-related data set; ignored")
+    return args
+
+
+def _setup_logging(level):
+    """Configure logging for the named level."""
     logging.basicConfig(
-        level=getattr(logging, args.log.upper(), None),
+        level=getattr(logging, level.upper(), None),
         format="%(asctime)s.%(msecs)03d %(levelname)s: %(message)s",
         datefmt="%H:%M:%S",
     )
-    return args
 
 
-def read_frd(path):
+def read_frd(path, workers=1, only=None):
     """
     Read and return the data in an frd file as a dictionary of dictionaries.
 
     The return value is a dictionary with the keys being the names of the
     data sets present in the FRD-file.
-    The values in the underlying dictionaries are tuples of ``float``.
-    The keys are the number of the node that the tuple belong to.
+    The data is stored by column. Each underlying dictionary has two keys.
+    Under “nodes” is an ``array.array`` of node numbers. Under “values” is a
+    list of ``array.array`` of ``float``, one for every column of the data
+    set. Item i in each column belongs to node i in “nodes”.
     Note that node numbers do not have to start at 1!
+
+    If workers is not 1, the data sets are converted in parallel by a pool
+    of that many processes. None means one process per CPU.
+
+    If only is given, it should be a collection of data set names. Only those
+    data sets are extracted.
     """
-    with open(path) as file:
-        lines = [ln.strip() for ln in file]
-    logging.info(f"file “{path}” contains {len(lines)} lines.")
-    ranges = _find_ranges(lines)
     contents = {}
-    for name in ranges.keys():
-        if name not in NODE_RELATED:
-            continue  # skip
-        first, last = ranges[name]
-        contents[name] = _process_float_data(lines, first, last)
-        logging.info(f"extracted {len(contents[name])} “{name}”")
+    names = NODE_RELATED if only is None else NODE_RELATED.intersection(only)
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        logging.info(f"file “{path}” contains {size} bytes.")
+        if not size:
+            return contents  # An empty file cannot be mapped.
+        pool = None if workers == 1 else ProcessPoolExecutor(workers)
+        try:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for name, start, end, rowlen, count in _find_blocks(mm, path, names):
+                    if pool:
+                        args = (path, start, end, rowlen, count)
+                        contents[name] = pool.submit(_read_block, *args)
+                    else:
+                        contents[name] = _parse_block(mm[start:end], rowlen, count)
+        finally:
+            if pool:
+                pool.shutdown()
+    if pool:
+        contents = {name: future.result() for name, future in contents.items()}
+    for name, data in contents.items():
+        logging.info(f"extracted {len(data['nodes'])} “{name}”")
     return contents
 
 
-def _find_ranges(lines):
-    """Find the start and end lines of the different data sets."""
-    starts, ends = {}, {}
-    for num, ln in enumerate(lines):
+def _find_blocks(mm, path, names):
+    """
+    Find the data sets listed in names in a memory-mapped FRD file.
+
+    Only the lines between data sets are read one by one. For every data set
+    header, the first data line and the “-3” line that ends the data set are
+    found by searching, which skips the component descriptions and the data.
+    Yields the name of the data set, the start and end offsets of its data
+    lines in mm, the length of a data line and the number of floats in it.
+    """
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    while ln := mm.readline():
         # Node data is preceded by a “2C”-line.
-        if ln.startswith("2C"):
-            starts["NODES"] = num + 1
-        # Element data is preceded by a “3C”-line
-        if ln.startswith("3C"):
-            starts["ELEMENTS"] = num + 1
+        if ln.startswith(b"    2C"):
+            name = "NODES"
+        # Element data is preceded by a “3C”-line.
+        elif ln.startswith(b"    3C"):
+            name = "ELEMENTS"
         # All other data is preceded by a “-4” line.
-        elif ln.startswith("-4"):
-            items = ln.split()
-            starts[items[1]] = num + 1
-        # Data ends with a “-3”-line.
-        elif ln.startswith("-3"):
-            ends[next(reversed(starts.keys()))] = num 
-    ranges = {name: (starts[name], ends[name]) for name in starts.keys()}
-    del starts, ends
-    return ranges
-
-
-def _process_float_data(lines, first, last):
-    """Convert node-related float data to a dictionary indexed by the node number."""
-    data = {}
-    while not lines[first].startswith("-1"):
-        first += 1
-    count = int(len(lines[first]) / 12)
-    indices = [(c * 12, (c + 1) * 12) for c in range(1, count)]
-    for ln in itt.islice(lines, first, last):
-        num = int(ln[2:12])
-        numbers = [float(ln[a:b]) for a, b in indices]
-        data[num] = tuple(numbers)
-    return data
+        elif ln.startswith(b" -4"):
+            name = ln.split(None, 2)[1].decode("ascii")
+        else:
+            continue
+        # The search starts at the newline of the header line.
+        pos = mm.tell() - 1
+        end = mm.find(b"\n -3", pos) + 1
+        if not end:
+            raise ValueError(f"unterminated data set “{name}” in “{path}”")
+        mm.seek(end)
+        # Data lines start with a “-1” and run until the “-3”-line.
+        start = mm.find(b"\n -1", pos, end) + 1
+        if not start or name not in names:
+            continue
+        ln = mm[start : mm.find(b"\n", start) + 1]
+        # Data lines start with a space, “-1” and a 10 character node
+        # number, followed by 12 character wide floating point numbers.
+        count = (len(ln.rstrip()) - 13) // 12
+        yield name, start, end, len(ln), count
+
+
+def _read_block(path, start, end, rowlen, count):
+    """Read the data lines between start and end from a file and parse them."""
+    with open(path, "rb") as file:
+        file.seek(start)
+        return _parse_block(file.read(end - start), rowlen, count)
+
+
+def _parse_block(buf, rowlen, count):
+    """
+    Parse a buffer of concatenated data lines of length rowlen, including
+    line endings.
+
+    The node numbers and the count floating point numbers are extracted from
+    the whole buffer by struct.iter_unpack and converted by map, so there is
+    no Python loop over the lines.
+    Returns a dictionary of the node numbers and the columns of floats.
+    """
+    if len(buf) % rowlen:
+        raise ValueError("data lines are not of equal length")
+    nodes, values = _block_structs(rowlen, count)
+    numbers = array("q", map(int, itt.chain.from_iterable(nodes.iter_unpack(buf))))
+    floats = array("d", map(float, itt.chain.from_iterable(values.iter_unpack(buf))))
+    return {"nodes": numbers, "values": [floats[c::count] for c in range(count)]}
+
+
+@functools.lru_cache
+def _block_structs(rowlen, count):
+    """
+    Create the struct.Struct pair that extracts the node numbers and the
+    floats from data lines of length rowlen containing count floats.
+
+    Data sets of the same kind share a layout, so these are compiled once.
+    """
+    pad = rowlen - 13 - 12 * count
+    nodes = struct.Struct(f"3x10s{12 * count + pad}x")
+    values = struct.Struct("13x" + "12s" * count + f"{pad}x")
+    return nodes, values
 
 
 def write_json(contents, name):
     """Write the contents dictionary to a JSON file."""
     logging.info(f"writing JSON file “{name}”")
-    with open(name, "w") as outfile:
-        outfile.write("{\n")
-        items = [[name, data, "  },\n"] for name, data in contents.items()]
-        items[-1][2] = "  }\n"
-        for name, data, sep in items:
-            outfile.write(f'  "{name}": ' + "{\n")
-            buffer = ",\n".join(
-                f'    "{node}": [{", ".join(str(f) for f in values)}]'
-                for node, values in data.items()
-            )
-            outfile.write(buffer + "\n")
-            outfile.write(sep)
-        outfile.write("}\n")
+    # Data sets are preceded by a separator. The rows of a data set come from
+    # _json_rows; each one starts with a separator which the first row lacks.
+    with open(name, "w", buffering=BUFSIZE) as outfile:
+        outfile.write("{")
+        sep = "\n"
+        for name, data in contents.items():
+            outfile.write(f'{sep}  "{name}": ' + "{\n")
+            rows = _json_rows(data)
+            outfile.write(next(rows, ",\n")[2:])
+            outfile.writelines(rows)
+            outfile.write("\n  }")
+            sep = ",\n"
+        outfile.write("\n}\n")
+
+
+def _json_rows(data):
+    """
+    Return an iterator of the rows of a data set as JSON text.
+
+    Every row starts with a comma and a newline.
+    """
+    nodes, values = data["nodes"], data["values"]
+    # The repr of a float is its shortest round-trip representation.
+    fmt = ',\n    "%d": [' + ", ".join(["%r"] * len(values)) + "]"
+    return map(fmt.__mod__, zip(nodes, *values))
 
 
 def write_pickle(contents, name):
     """Write the contents dictionary to a pickle file."""
     logging.info(f"writing pickle file “{name}”")
-    with open(name, "wb") as outfile:
+    with open(name, "wb", buffering=BUFSIZE) as outfile:
         pickle.dump(contents, outfile)
 
 
@@ -258,22 +415,76 @@ def write_sqlite(contents, name):
         os.remove(name)
     # Write new database.
     logging.info(f"writing sqlite database “{name}”")
-    with sqlite3.connect(name) as con:
+    con = sqlite3.connect(name)
+    try:
+        # The database is created from scratch, so durability is not an issue.
+        for pragma in SQLITE_PRAGMAS:
+            con.execute(f"PRAGMA {pragma};")
+        # Write all tables in a single transaction.
+        con.execute("BEGIN;")
         for name, data in contents.items():
-            firstkey = next(iter(data.keys()))
-            length = len(data[firstkey]) + 1
+            length = len(data["values"]) + 1
             tableq = f"CREATE TABLE {name}(node INTEGER PRIMARY KEY, "
             tableq += ", ".join(f"r{idx} REAL" for idx in range(1, length))
             tableq += ");"
             logging.debug(tableq)
             con.execute(tableq)
-            con.commit()
-            insq = f"INSERT INTO {name} VALUES (?, "
-            insq += ", ".join("?" for idx in range(1, length))
-            insq += ");"
+            # Insert as many rows per statement as the parameter limit allows.
+            # This saves the per-statement overhead in the sqlite3 module.
+            per = max(SQLITE_VARIABLES // length, 1)
+            row = "(" + ", ".join("?" * length) + ")"
+            multiq = f"INSERT INTO {name} VALUES " + ", ".join([row] * per) + ";"
+            insq = f"INSERT INTO {name} VALUES {row};"
             logging.debug(insq)
-            con.executemany(insq, ((k, *v) for k, v in data.items()))
-            con.commit()
+            rows = zip(data["nodes"], *data["values"])
+            count = len(data["nodes"]) // per * per
+            flat = itt.chain.from_iterable(itt.islice(rows, count))
+            params = zip(*[flat] * (per * length))
+            while batch := list(itt.islice(params, SQLITE_BATCH // per)):
+                con.executemany(multiq, batch)
+            # The remaining rows are inserted one at a time.
+            con.executemany(insq, rows)
+        con.commit()
+    finally:
+        # Closing also releases the exclusive lock.
+        con.close()
+
+
+def write_parquet(contents, name):
+    """
+    Write the contents dictionary to a directory of Parquet files.
+
+    Every data set is written to its own file in the directory name, with an
+    int64 column “node” and float64 columns “r1” and onwards, like the tables
+    written by write_sqlite. The arrays are passed to pyarrow without copying.
+    Since the files have different columns, they should be read one at a
+    time, not as a single dataset of the whole directory.
+    Requires the pyarrow module.
+    """
+    if pyarrow is None:
+        raise ModuleNotFoundError("writing Parquet files requires pyarrow")
+    # Remove Parquet files from an earlier run.
+    if os.path.isdir(name):
+        for fn in os.listdir(name):
+            if fn.endswith(".parquet"):
+                logging.info(f"removing existing file “{fn}” from “{name}”")
+                os.remove(os.path.join(name, fn))
+    logging.info(f"writing Parquet files in “{name}”")
+    os.makedirs(name, exist_ok=True)
+    for dsname, data in contents.items():
+        columns = {"node": _arrow_array(pyarrow.int64(), data["nodes"])}
+        for idx, values in enumerate(data["values"], start=1):
+            columns[f"r{idx}"] = _arrow_array(pyarrow.float64(), values)
+        table = pyarrow.table(columns)
+        path = os.path.join(name, dsname + ".parquet")
+        logging.debug(f"writing “{path}”")
+        pyarrow.parquet.write_table(table, path, compression="zstd")
+
+
+def _arrow_array(kind, values):
+    """Wrap an array.array in a pyarrow array of the given type."""
+    buffer = pyarrow.py_buffer(values)
+    return pyarrow.Array.from_buffers(kind, len(values), [None, buffer])
 
 
 if __name__ == "__main__":